@@ -3,14 +3,15 @@ from __future__ import annotations
 import contextlib
 import dataclasses
 import os
-from typing import Dict, Final, Generator, List, Optional, Tuple
-
-import pandas as pd
+from typing import TYPE_CHECKING, Dict, Final, Generator, List, Optional, Tuple
 
 from meadowdb import reader, writer
 from meadowdb.readerwriter_shared import TableSchema, UserspaceSpec
 from meadowdb.table_versions_client_local import TableVersionsClientLocal
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 try:
     # we try to import meadowflow.effects because we want to make sure that
     # _save_effects gets registered in the case where the user code only references
@@ -1,13 +1,31 @@
 from __future__ import annotations
 
 import abc
+import collections
 import collections.abc
 import datetime
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Iterable, List, Literal, Optional, Tuple, Union, cast, overload
-
-import duckdb
-import pandas as pd
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    TYPE_CHECKING,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+    overload,
+)
 
 from meadowdb.readerwriter_shared import (
     DeleteAllLogEntry,
@@ -21,6 +39,16 @@ from meadowdb.readerwriter_shared import (
 from meadowdb.storage import KeyValueStore
 from meadowdb.table_versions_client_local import TableVersionsClientLocal
 
+if TYPE_CHECKING:
+    # duckdb, pandas and pyarrow are slow to import, so we only import them when we
+    # actually read data. That way, constructing queries and importing this module
+    # stay cheap.
+    import duckdb
+    import numpy as np
+    import pandas as pd
+    import pyarrow
+    import pyarrow.parquet
+
 
 def read(
     table_version_client: TableVersionsClientLocal,
@@ -53,7 +81,7 @@ def read(
     table_schema = TableSchema()
     for table_version in table_versions:
         if table_version.table_schema_filename:
-            table_schema = table_version_client.store.get_pickle(
+            table_schema = table_version_client.store.get_pickle_cached(
                 table_version.table_schema_filename
             )
         table_log_filenames.append(table_version.table_log_filename)
@@ -66,7 +94,7 @@ def read(
         [
             table_log_entry
             for table_log_filename in table_log_filenames
-            for table_log_entry in table_version_client.store.get_pickle(
+            for table_log_entry in table_version_client.store.get_pickle_cached(
                 table_log_filename
             )
         ],
@@ -100,16 +128,261 @@ def _get_table_versions_base_to_tip(
     return table_versions
 
 
+# duckdb connections are not threadsafe, so we keep one per thread. See _get_conn
+_thread_local = threading.local()
+
+
+def _get_conn() -> duckdb.DuckDBPyConnection:
+    """
+    Returns an in-memory duckdb connection for the current thread. Reusing a connection
+    avoids paying duckdb's startup costs on every to_pd call, and lets duckdb cache
+    parquet metadata across queries.
+    """
+    conn = getattr(_thread_local, "conn", None)
+    if conn is None:
+        import duckdb
+
+        conn = duckdb.connect(":memory:")
+        conn.execute(f"PRAGMA threads={os.cpu_count() or 1}")
+        conn.execute("PRAGMA enable_object_cache")
+        _thread_local.conn = conn
+    return conn
+
+
+_footer_executor: Optional[ThreadPoolExecutor] = None
+_footer_executor_lock = threading.Lock()
+
+
+def _get_footer_executor() -> ThreadPoolExecutor:
+    """
+    Returns a thread pool for reading parquet footers. Reading footers is mostly
+    waiting on I/O, so we can read them in parallel with each other.
+    """
+    global _footer_executor
+    with _footer_executor_lock:
+        if _footer_executor is None:
+            _footer_executor = ThreadPoolExecutor(
+                max_workers=4, thread_name_prefix="meadowdb_footer"
+            )
+        return _footer_executor
+
+
+class _QueryParameters:
+    """
+    Collects the parameters for a query while we're constructing the SQL for it:
+    literals that get passed to conn.execute, and arrow tables that need to be
+    registered with the connection.
+    """
+
+    def __init__(self) -> None:
+        self.values: List[Any] = []
+        # name -> (the column that the table's values are compared to, table)
+        self.tables: Dict[str, Tuple[str, pyarrow.Table]] = {}
+
+    def add_value(self, value: Any) -> str:
+        """
+        Adds a literal and returns the placeholder to use for it in the SQL. Passing
+        literals as parameters means we don't need to worry about quoting them, and
+        duckdb doesn't need to re-parse the query when only the literals change.
+        """
+        # duckdb doesn't accept numpy scalars as parameters, e.g. from df["a"][0]. We
+        # check the module rather than isinstance(value, np.generic) so that we don't
+        # import numpy just to construct a query.
+        if type(value).__module__ == "numpy":
+            if value.dtype.kind == "M":
+                # .item() returns an int for nanosecond datetime64s
+                value = value.astype("datetime64[us]")
+            value = value.item()
+        self.values.append(value)
+        return "?"
+
+    def add_table(self, column_name: str, table: pyarrow.Table) -> str:
+        """
+        Adds an arrow table with a single column v whose values will be compared to
+        column_name. Returns the name to use for the table in the SQL.
+        """
+        table_name = f"__mdb_reserved_params_{len(self.tables)}__"
+        self.tables[table_name] = column_name, table
+        return table_name
+
+
+# isin lists with at least this many items are passed to duckdb as an arrow table
+# rather than as a list parameter
+_IN_TABLE_MIN_ITEMS = 100
+
 # Some strings used in internal sql construction
-_table_name_placeholder = "[!!__to_be_replaced_table_name__!!]"
-# TODO P1 throw an exception if someone tries to use this __mdb_reserved_indicator__
-#  reserved column name
-_indicator_column_name = "__mdb_reserved_indicator__"
+# Identifies which log entry a row came from, newer log entries have bigger ordinals
+_ordinal_column_name = "__mdb_reserved_ordinal__"
+# The position of a row within its file
+_file_row_number_column_name = "__mdb_reserved_file_row_number__"
+# read_parquet adds these columns when we ask it for filenames and row numbers, so we
+# can't use those options on files that already have columns with these names
+_read_parquet_generated_columns = ("filename", "file_row_number")
+
+
+def _sql_string_literal(s: str) -> str:
+    return "'" + s.replace("'", "''") + "'"
+
+
+def _read_parquet_sql(
+    files: List[Tuple[int, str]],
+    columns: Optional[Iterable[str]] = None,
+) -> str:
+    """
+    files is a list of (ordinal, path). Returns a subquery that reads all of the
+    specified parquet files with a single read_parquet call. duckdb preserves the order
+    of the files and of the rows within them, so we don't need to sort the result.
+
+    If columns is specified, only those columns are read from the files.
+    """
+    select_list = "*" if columns is None else ", ".join(f'"{c}"' for c in columns)
+    return (
+        f"(SELECT {select_list} FROM read_parquet(["
+        + ", ".join(_sql_string_literal(path) for _, path in files)
+        + "], union_by_name=true))"
+    )
+
+
+def _read_parquet_with_ordinal_sql(
+    files: List[Tuple[int, str]],
+    file_columns: Dict[str, List[str]],
+    tables: Dict[str, pyarrow.Table],
+    columns: Optional[Iterable[str]] = None,
+) -> str:
+    """
+    files is a list of (ordinal, path), and file_columns maps each path to the columns
+    in that file. Returns a subquery that reads all of the specified parquet files,
+    adding _ordinal_column_name and _file_row_number_column_name columns so that we can
+    tell where each row came from.
+
+    Files are read with a single read_parquet call where possible. Files that have
+    columns that clash with _read_parquet_generated_columns can't be read that way, so
+    we read those with pyarrow and add them to tables, which need to be registered with
+    the connection before running the query.
+
+    If columns is specified, only those columns are read from the files. Because
+    parquet is a columnar format, the other columns are never read or decoded.
+    """
+    read_parquet_files = [
+        (i, path)
+        for i, path in files
+        if not any(c in _read_parquet_generated_columns for c in file_columns[path])
+    ]
+
+    subqueries = []
+    if read_parquet_files:
+        if columns is None:
+            select_list = ["* EXCLUDE (filename, file_row_number)"]
+        else:
+            available_columns = set(
+                itertools.chain.from_iterable(
+                    file_columns[path] for _, path in read_parquet_files
+                )
+            )
+            select_list = [f'"{c}"' for c in columns if c in available_columns] + [
+                _ordinal_column_name
+            ]
+        select_list.append(f"file_row_number AS {_file_row_number_column_name}")
+        subqueries.append(
+            f"SELECT {', '.join(select_list)} FROM read_parquet(["
+            + ", ".join(_sql_string_literal(path) for _, path in read_parquet_files)
+            + "], filename=true, file_row_number=true, union_by_name=true) "
+            + "JOIN (VALUES "
+            + ", ".join(
+                f"({_sql_string_literal(path)}, {i})" for i, path in read_parquet_files
+            )
+            + f") AS ordinals(filename, {_ordinal_column_name}) USING (filename)"
+        )
+
+    if len(read_parquet_files) < len(files):
+        import pyarrow
+        import pyarrow.parquet
+
+        read_parquet_paths = set(path for _, path in read_parquet_files)
+        for i, path in files:
+            if path not in read_parquet_paths:
+                # this reads the whole file into memory, but tables with these column
+                # names should be rare
+                table = pyarrow.parquet.read_table(path)
+                if columns is not None:
+                    table = table.select(
+                        [c for c in columns if c in table.column_names]
+                    )
+                table = table.append_column(
+                    _ordinal_column_name,
+                    pyarrow.array([i] * table.num_rows, pyarrow.int32()),
+                ).append_column(
+                    _file_row_number_column_name,
+                    pyarrow.array(range(table.num_rows), pyarrow.int64()),
+                )
+                name = f"__mdb_reserved_file_{len(tables)}__"
+                tables[name] = table
+                subqueries.append(f"SELECT * FROM {name}")
+
+    return "(" + " UNION ALL BY NAME ".join(subqueries) + ")"
+
+
+def _row_group_statistics(
+    metadata: pyarrow.parquet.FileMetaData, column_order: List[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the min/max statistics for the columns in column_order in each row group of
+    a parquet file, given the file's footer, as two (num_row_groups, len(column_order))
+    object arrays of mins and maxs that can be passed to a function returned by
+    MdbBoolColumn._compile_statistics_filter. Missing statistics are None.
+
+    We only read the statistics for the columns in column_order (usually just the
+    columns that the filter references), as the other columns can be much wider.
+    """
+    import numpy as np
+
+    mins = np.full((metadata.num_row_groups, len(column_order)), None, dtype=object)
+    maxs = np.full((metadata.num_row_groups, len(column_order)), None, dtype=object)
+    parquet_column_indices = {name: j for j, name in enumerate(metadata.schema.names)}
+    column_indices = [
+        (k, parquet_column_indices[column])
+        for k, column in enumerate(column_order)
+        if column in parquet_column_indices
+    ]
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for k, j in column_indices:
+            statistics = row_group.column(j).statistics
+            if statistics is not None and statistics.has_min_max:
+                column_max = statistics.max
+                if isinstance(column_max, datetime.datetime):
+                    # pyarrow truncates nanosecond timestamps to microseconds
+                    column_max += datetime.timedelta(microseconds=1)
+                mins[i, k] = statistics.min
+                maxs[i, k] = column_max
+    return mins, maxs
+
+
+def _is_float(values: np.ndarray) -> np.ndarray:
+    """Returns a bool array that says which elements of an object array are floats"""
+    import numpy as np
+
+    return np.fromiter((isinstance(v, float) for v in values), bool, len(values))
+
+
+def _categorical_columns(schema: pyarrow.Schema) -> List[str]:
+    """
+    Returns the columns in a parquet file (given its schema) that were categoricals in
+    the pd.DataFrame that was written
+    """
+    pandas_metadata = schema.pandas_metadata
+    if pandas_metadata is None:
+        return []
+    return [
+        column["name"]
+        for column in pandas_metadata["columns"]
+        if column["pandas_type"] == "categorical"
+    ]
 
 
 @dataclass(frozen=True)
 class _SelectColumnsOp:
-    columns_to_select: Iterable[str]
+    columns_to_select: Tuple[str, ...]
 
 
 @dataclass(frozen=True)
@@ -171,7 +444,7 @@ class MdbTable:
                 self._table_schema,
                 self._store,
                 self._log_entry_list,
-                self._ops + [_SelectColumnsOp(item)],
+                self._ops + [_SelectColumnsOp(tuple(item))],
             )
         elif isinstance(
             item, (MdbComputedBoolColumnOpArg, MdbComputedBoolColumnOpColumn)
@@ -214,200 +487,477 @@ class MdbTable:
 
         The general strategy is to take the query operations that have been specified
         (self._ops) and translate them into a SQL query, and then use duckdb to execute
-        that query on the underlying data files (self._log_entry_list).
+        that query on the underlying data files (self._log_entry_list). All of the data
+        files are read by a single query so that duckdb can scan them in parallel and
+        push the user's filters down into the parquet reader.
         """
-        conn = duckdb.connect(":memory:")
-
-        select_clause, where_clause = self._construct_sql()
+        import pandas as pd
 
-        # stores the materialized pd.DataFrame for each partition
-        partition_results: List[pd.DataFrame] = []
-        deduplication_keys = self._table_schema.deduplication_keys
-        # we'll keep track of the deduplication key values and deletes that we've seen
-        # so that we can filter them out of older partitions
-        # TODO possibly better to not keep deduplication_keys_seen and deletes in memory
-        deduplication_keys_seen = pd.DataFrame()
-        deletes = pd.DataFrame()
-
-        # we have to iterate newest partitions first so we know what to filter out of
-        # older partitions
-        for i, log_entry in enumerate(reversed(self._log_entry_list)):
-            if isinstance(log_entry, WriteLogEntry):
-                # materialize the write into a pd.DataFrame, applying any filters the
-                # user specified (select_clause, where_clause), as well as any
-                # deduplication_key-based filters and deletes that we've seen so far
-                table_name = f"t{i}"
-                table_relation = self._store.get_parquet_duckdb_relation(
-                    log_entry.data_filename, conn
-                )
-                table_relation.create_view(table_name)
-
-                if len(deduplication_keys_seen) == 0:  # or deduplication_keys is None
-                    if len(deletes) == 0:
-                        # simplest case--no deletes or deduplication_keys to filter out
-                        sql = (
-                            select_clause.replace(_table_name_placeholder, table_name)
-                            + f" FROM {table_name} WHERE "
-                            + where_clause.replace(_table_name_placeholder, table_name)
-                        )
-                    else:
-                        # case where we have delete_where_equal
-                        conn.register("ds", deletes)
-                        sql = (
-                            select_clause.replace(_table_name_placeholder, table_name)
-                            + f" FROM {table_name} LEFT JOIN ds ON "
-                            + " AND ".join(
-                                f"{table_name}.{c} = ds.{c}"
-                                for c in deletes.columns
-                                if c != _indicator_column_name
-                            )
-                            + f" WHERE ds.{_indicator_column_name} IS NULL AND "
-                            + where_clause.replace(_table_name_placeholder, table_name)
-                        )
-                else:
-                    if len(deletes) == 0:
-                        # case where we have deduplication_keys (automatically
-                        # overwriting rows based on the deduplication_keys)
-
-                        # TODO this could be implemented at write time as just another
-                        #  delete, that might be the right thing to do?
-                        # TODO check performance--is special antijoin code being hit?
-                        #  are statistics being used?
-                        # TODO the below line is unnecessary if deduplication_keys_seen
-                        #  hasn't been updated between iterations
-                        conn.register("pks", deduplication_keys_seen)
-                        sql = (
-                            select_clause.replace(_table_name_placeholder, table_name)
-                            + f" FROM {table_name} LEFT JOIN pks ON "
-                            + " AND ".join(
-                                f"{table_name}.{c} = pks.{c}"
-                                for c in deduplication_keys
-                            )
-                            + f" WHERE pks.{_indicator_column_name} IS NULL AND "
-                            + where_clause.replace(_table_name_placeholder, table_name)
-                        )
-                    else:
-                        # case where we have deduplication_keys AND deletes
-                        conn.register("pks", deduplication_keys_seen)
-                        conn.register("ds", deletes)
-                        sql = (
-                            select_clause.replace(_table_name_placeholder, table_name)
-                            + f" FROM {table_name} LEFT JOIN ds ON "
-                            + " AND ".join(
-                                f"{table_name}.{c} = ds.{c}"
-                                for c in deletes.columns
-                                if c != _indicator_column_name
-                            )
-                            + " LEFT JOIN pks ON "
-                            + " AND ".join(
-                                f"{table_name}.{c} = pks.{c}"
-                                for c in deduplication_keys
-                            )
-                            + f" WHERE ds.{_indicator_column_name} IS NULL AND "
-                            + f"pks.{_indicator_column_name} IS NULL AND "
-                            + where_clause.replace(_table_name_placeholder, table_name)
-                        )
-
-                # Uncommenting this line is helpful in debugging the sql generation
-                # print(sql)
-                conn.execute(sql)
-                df = cast(pd.DataFrame, conn.fetchdf())
-                partition_results.append(df)
-
-                if deduplication_keys:
-                    # add this partition's deduplication keys to the list of
-                    # deduplication keys we've seen
-                    deduplication_keys_seen = pd.concat(
-                        [
-                            deduplication_keys_seen,
-                            df[deduplication_keys].assign(
-                                **{_indicator_column_name: 1}
-                            ),
-                        ]
-                    )
-            elif isinstance(log_entry, DeleteLogEntry):
-                # Read deletes so we can use them to filter out rows in older partitions
+        table_name = "t"
+        filter_column, select_clause, where_clause, params = self._construct_sql(
+            table_name
+        )
 
-                # pd.read_parquet would be faster, but this way we're always using the
-                # same engine
-                d = cast(
-                    pd.DataFrame,
-                    self._store.get_parquet_duckdb_relation(
-                        log_entry.data_filename, conn
-                    ).to_df(),
-                )
-                d[_indicator_column_name] = 1
+        conn = _get_conn()
 
-                if len(deletes) > 0 and sorted(deletes.columns) != sorted(d.columns):
-                    # TODO P1 this should really throw an error at write time (or we
-                    #  should add support for it)
-                    raise NotImplementedError(
-                        "Deletes on different sets of columns is not supported"
-                    )
-                deletes = pd.concat([deletes, d])
-            elif isinstance(log_entry, DeleteAllLogEntry):
-                # delete_all means stop iterating
+        # Figure out which log entries are still relevant. A delete_all means we can
+        # ignore everything before it. Each remaining entry gets an ordinal, with older
+        # entries getting smaller ordinals.
+        live_log_entries: List[TableLogEntry] = []
+        for log_entry in reversed(self._log_entry_list):
+            if isinstance(log_entry, DeleteAllLogEntry):
                 break
+            elif isinstance(log_entry, (WriteLogEntry, DeleteLogEntry)):
+                live_log_entries.append(log_entry)
             else:
                 raise ValueError(f"data_file_type {log_entry} is not supported")
+        live_log_entries.reverse()
 
-        # put the results together
-        partition_results.reverse()
+        writes = [
+            (i, self._store.get_parquet_duckdb_path(log_entry.data_filename))
+            for i, log_entry in enumerate(live_log_entries)
+            if isinstance(log_entry, WriteLogEntry)
+        ]
 
-        if len(partition_results) == 0:
+        if len(writes) == 0:
             # TODO use `columns` when returning an empty dataframe
             return pd.DataFrame()
+
+        import pyarrow.parquet
+
+        # Read the footers of all of the writes in parallel. We need their schemas to
+        # figure out how to read them, and their statistics to skip writes.
+        executor = _get_footer_executor()
+        write_metadata = dict(
+            zip(
+                [path for _, path in writes],
+                executor.map(
+                    pyarrow.parquet.read_metadata, [path for _, path in writes]
+                ),
+            )
+        )
+        write_schemas = {
+            path: metadata.schema.to_arrow_schema()
+            for path, metadata in write_metadata.items()
+        }
+        file_columns = {path: schema.names for path, schema in write_schemas.items()}
+        # duckdb reads categoricals as plain strings, so we convert them back to
+        # categoricals based on the newest write rather than returning a column of
+        # python string objects
+        categorical_columns = _categorical_columns(write_schemas[writes[-1][1]])
+
+        if isinstance(filter_column, _MdbConstBoolColumn) and not filter_column._value:
+            # The row filter can never be true, so no need to read any data. We still
+            # combine the schemas of all of the writes the same way union_by_name does
+            # so that we return the right columns and dtypes.
+            try:
+                schema = pyarrow.unify_schemas(list(write_schemas.values()))
+            except pyarrow.ArrowInvalid:
+                # e.g. a column has different types in different writes, so let duckdb
+                # figure out the type by running the query
+                pass
+            else:
+                selected_columns = self._selected_columns()
+                if selected_columns is not None:
+                    schema = pyarrow.schema(
+                        [schema.field(c) for c in selected_columns if c in schema.names]
+                    )
+                return cast(
+                    pd.DataFrame,
+                    schema.remove_metadata()
+                    .empty_table()
+                    .to_pandas(
+                        categories=[
+                            c for c in categorical_columns if c in schema.names
+                        ],
+                        date_as_object=False,
+                    ),
+                )
+
+        # Skip writes where the parquet statistics tell us that no rows can match the
+        # user's filter. Skipping a write would change the columns and types that
+        # union_by_name gives us, so we only do this if all of the writes have the
+        # same schema. Always keep at least the newest write so that we have something
+        # to read the columns from if we skip everything.
+        filter_columns: Set[str] = set()
+        if filter_column is not None:
+            filter_column._referenced_columns(filter_columns)
+        newest_schema = write_schemas[writes[-1][1]]
+        if (
+            filter_column is not None
+            and len(writes) > 1
+            and all(schema.equals(newest_schema) for schema in write_schemas.values())
+        ):
+            import numpy as np
+
+            # Compile the filter once and evaluate it on the statistics of every row
+            # group of every write at once. A write can match if any of its row groups
+            # can match.
+            column_order = sorted(filter_columns)
+            statistics_filter = filter_column._compile_statistics_filter(column_order)
+            all_row_group_statistics = [
+                _row_group_statistics(write_metadata[path], column_order)
+                for _, path in writes[:-1]
+            ]
+            row_groups_can_match = statistics_filter(
+                np.concatenate([mins for mins, _ in all_row_group_statistics]),
+                np.concatenate([maxs for _, maxs in all_row_group_statistics]),
+            )
+            # the number of row groups that can match in each write, computed from
+            # the cumulative sum (np.add.reduceat doesn't handle empty writes)
+            row_group_counts = np.array(
+                [len(mins) for mins, _ in all_row_group_statistics], dtype=int
+            )
+            row_groups_end = np.cumsum(row_group_counts)
+            cumulative_matches = np.concatenate([[0], np.cumsum(row_groups_can_match)])
+            writes_can_match = (
+                cumulative_matches[row_groups_end]
+                > cumulative_matches[row_groups_end - row_group_counts]
+            )
+            writes = [
+                write
+                for write, can_match in zip(writes[:-1], writes_can_match)
+                if can_match
+            ] + writes[-1:]
+
+        # deletes that are older than all of the writes can't filter anything out, so
+        # don't bother joining against them
+        oldest_write = writes[0][0]
+        delete_log_entries = [
+            (i, log_entry)
+            for i, log_entry in enumerate(live_log_entries)
+            if isinstance(log_entry, DeleteLogEntry) and i > oldest_write
+        ]
+
+        # deduplication can't change anything if there's only one write
+        deduplication_keys = self._table_schema.deduplication_keys
+        if not deduplication_keys or len(writes) <= 1:
+            deduplication_keys = []
+
+        delete_columns: List[str] = []
+        if delete_log_entries:
+            deletes = [
+                (i, self._store.get_parquet_duckdb_path(log_entry.data_filename))
+                for i, log_entry in delete_log_entries
+            ]
+
+            # the deletes never leave duckdb: we just need their column names (from
+            # the parquet footers) to construct the join
+            delete_columns_by_file = conn.execute(
+                "SELECT file_name, list(name) FROM parquet_schema(?) "
+                "WHERE num_children IS NULL GROUP BY file_name",
+                [[path for _, path in deletes]],
+            ).fetchall()
+            file_columns.update(delete_columns_by_file)
+            delete_columns = delete_columns_by_file[0][1]
+            if any(
+                sorted(columns) != sorted(delete_columns)
+                for _, columns in delete_columns_by_file
+            ):
+                # TODO P1 this should really throw an error at write time (or we
+                #  should add support for it)
+                raise NotImplementedError(
+                    "Deletes on different sets of columns is not supported"
+                )
+
+        # If the user selected a subset of columns, only read the columns that we
+        # actually need from the writes: the selected columns, plus the columns needed
+        # to filter, delete, and deduplicate rows
+        selected_columns = self._selected_columns()
+        needed_columns: Optional[Iterable[str]]
+        if selected_columns is None:
+            needed_columns = None
         else:
-            return pd.concat(partition_results, ignore_index=True)
+            needed_columns = dict.fromkeys(
+                itertools.chain(
+                    selected_columns,
+                    deduplication_keys,
+                    delete_columns,
+                    sorted(filter_columns),
+                )
+            ).keys()
+
+        # arrow tables that _read_parquet_with_ordinal_sql needs us to register
+        file_tables: Dict[str, pyarrow.Table] = {}
+
+        # Deletes and deduplication need to know which log entry each row came from,
+        # and the joins for them don't preserve the order of the rows. duckdb (as of
+        # 0.8.1) can also evaluate filters with joins, e.g. it turns IN lists of
+        # parameters into a join. Only then do we add ordinals and sort by them,
+        # otherwise duckdb returns the rows in the order they were written.
+        ordered = (
+            bool(delete_log_entries)
+            or bool(deduplication_keys)
+            or (
+                filter_column is not None
+                and not isinstance(filter_column, _MdbConstBoolColumn)
+            )
+        )
 
-    def _construct_sql(self) -> Tuple[str, str]:
+        # from_where_sql selects the rows that match the user's filter and haven't been
+        # deleted, before deduplication
+        if ordered:
+            writes_sql = _read_parquet_with_ordinal_sql(
+                writes, file_columns, file_tables, needed_columns
+            )
+            if selected_columns is None:
+                select_clause += (
+                    f" EXCLUDE ({_ordinal_column_name}, "
+                    f"{_file_row_number_column_name})"
+                )
+        else:
+            writes_sql = _read_parquet_sql(writes, needed_columns)
+        from_where_sql = f" FROM {writes_sql} AS {table_name}"
+
+        if delete_log_entries:
+            # delete_where_equal: a row in a write is deleted if there's a matching row
+            # in a delete that is newer than the write
+            from_where_sql += (
+                " ANTI JOIN "
+                + _read_parquet_with_ordinal_sql(deletes, file_columns, file_tables)
+                + " AS ds ON "
+                + " AND ".join(f'{table_name}."{c}" = ds."{c}"' for c in delete_columns)
+                + f" AND ds.{_ordinal_column_name} > "
+                + f"{table_name}.{_ordinal_column_name}"
+            )
+
+        from_where_sql += f" WHERE {where_clause}"
+
+        if deduplication_keys:
+            # deduplication_keys automatically overwrite rows, so only keep rows that
+            # come from the newest write with that deduplication key. We find the newest
+            # write for each deduplication key with a hash aggregate and then join
+            # against that, which is linear in the number of rows, unlike a window
+            # function which needs to sort each partition. Rows with NULL keys never
+            # overwrite each other, so they don't match anything in newest and are
+            # always kept.
+            # TODO this could be implemented at write time as just another delete, that
+            #  might be the right thing to do?
+            keys = ", ".join(f'"{c}"' for c in deduplication_keys)
+            sql = (
+                f"WITH filtered AS (SELECT {table_name}.*{from_where_sql}) "
+                + select_clause
+                + f" FROM filtered AS {table_name} LEFT JOIN (SELECT {keys}, "
+                + f"max({_ordinal_column_name}) AS {_ordinal_column_name} "
+                + "FROM filtered WHERE "
+                + " AND ".join(f'"{c}" IS NOT NULL' for c in deduplication_keys)
+                + f" GROUP BY {keys}) AS newest ON "
+                + " AND ".join(
+                    f'{table_name}."{c}" = newest."{c}"' for c in deduplication_keys
+                )
+                + f" WHERE newest.{_ordinal_column_name} IS NULL OR "
+                + f"newest.{_ordinal_column_name} = {table_name}.{_ordinal_column_name}"
+            )
+        else:
+            sql = select_clause + from_where_sql
+
+        if ordered:
+            # the joins above don't preserve the order of the rows, so put them back in
+            # the order they were written
+            sql += (
+                f" ORDER BY {table_name}.{_ordinal_column_name}, "
+                f"{table_name}.{_file_row_number_column_name}"
+            )
+
+        # Uncommenting this line is helpful in debugging the sql generation
+        # print(sql)
+        try:
+            for name, table in file_tables.items():
+                conn.register(name, table)
+            if params.tables:
+                # Cast the values in each arrow table to the type of the column they're
+                # compared to, the same way duckdb casts a scalar parameter, e.g. so
+                # that strings can be compared to timestamps
+                column_types = {
+                    row[0]: row[1]
+                    for row in conn.execute(
+                        f"DESCRIBE SELECT * FROM {writes_sql}"
+                    ).fetchall()
+                }
+            for name, (column_name, table) in params.tables.items():
+                conn.register(f"{name}values", table)
+                if column_name in column_types:
+                    conn.execute(
+                        f"CREATE OR REPLACE TEMP VIEW {name} AS SELECT "
+                        f"CAST(v AS {column_types[column_name]}) AS v "
+                        f"FROM {name}values"
+                    )
+                else:
+                    # the query will fail with a clear error about the missing column
+                    conn.execute(
+                        f"CREATE OR REPLACE TEMP VIEW {name} AS SELECT v "
+                        f"FROM {name}values"
+                    )
+            result = conn.execute(sql, params.values).fetch_arrow_table()
+        finally:
+            for name in params.tables:
+                conn.execute(f"DROP VIEW IF EXISTS {name}")
+                conn.unregister(f"{name}values")
+            for name in file_tables:
+                conn.unregister(name)
+
+        categorical_columns = [
+            c for c in categorical_columns if c in result.column_names
+        ]
+        # arrow converts nulls in object columns (e.g. strings and nullable bools) to
+        # None, but we've always returned NaN for them
+        null_object_columns = [
+            name
+            for name, column in zip(result.column_names, result.columns)
+            if column.null_count > 0 and name not in categorical_columns
+        ]
+
+        # Going through arrow and converting to pandas exactly once is cheaper than
+        # fetchdf. self_destruct frees each arrow column as soon as it's converted so
+        # that we don't hold two copies of the result in memory. date_as_object=False
+        # returns dates as datetime64 like fetchdf did.
+        df = cast(
+            pd.DataFrame,
+            result.to_pandas(
+                categories=categorical_columns,
+                date_as_object=False,
+                self_destruct=True,
+                split_blocks=True,
+                use_threads=True,
+            ),
+        )
+        for c in null_object_columns:
+            if df[c].dtype == object:
+                df[c] = df[c].fillna(float("nan"))
+        return df
+
+    def _construct_sql(
+        self, table_name: str
+    ) -> Tuple[Optional[MdbBoolColumn], str, str, _QueryParameters]:
         """
-        Returns a select_clause and a where_clause. These clauses reflect the
-        user-supplied operations on this MdbTable. Both clauses need to have
-        .replace(_table_name_placeholder, table_name) called on them.
+        Returns the simplified filter column (see _filter_column), a select_clause, a
+        where_clause, and parameters for the where_clause. These clauses reflect the
+        user-supplied operations on this MdbTable, and refer to the data as table_name.
+        The where_clause uses ? placeholders for literals and refers to tables that need
+        to be registered, see _QueryParameters.
+
+        The clauses and parameters are memoized based on the structure of the
+        operations, so e.g. re-running t[t['column1'] > 5] in a notebook reuses the
+        same sql. Callers must not modify them.
         """
+        selected_columns = self._selected_columns()
+        filter_column = self._filter_column()
+
+        key = (
+            table_name,
+            self._version_number,
+            None if selected_columns is None else tuple(selected_columns),
+            None if filter_column is None else filter_column._sql_cache_key(),
+        )
+        with _sql_cache_lock:
+            result = _sql_cache.get(key)
+            if result is not None:
+                _sql_cache.move_to_end(key)
+        if result is None:
+            result = self._construct_sql_uncached(
+                table_name, selected_columns, filter_column
+            )
+            with _sql_cache_lock:
+                _sql_cache[key] = result
+                if len(_sql_cache) > _SQL_CACHE_MAX_SIZE:
+                    _sql_cache.popitem(last=False)
+        return (filter_column, *result)
+
+    def _construct_sql_uncached(
+        self,
+        table_name: str,
+        selected_columns: Optional[Iterable[str]],
+        filter_column: Optional[MdbBoolColumn],
+    ) -> Tuple[str, str, _QueryParameters]:
 
         # TODO some weirdness here where you can do t1 = t['a', 'b']; t1[t1['c'] == 3].
         #  This shouldn't work (c has been filtered out), but it will for now
 
         # filtering columns, aka select_clause
-        column_args = [
-            op.columns_to_select for op in self._ops if isinstance(op, _SelectColumnsOp)
-        ]
-        if len(column_args) == 0:
-            select_clause = f"SELECT {_table_name_placeholder}.*"
+        if selected_columns is None:
+            select_clause = f"SELECT {table_name}.*"
         else:
-            curr_columns = column_args[0]
-            for next_columns in column_args[1:]:
-                columns_not_previously_selected = [
-                    a for a in next_columns if a not in curr_columns
-                ]
-                if len(columns_not_previously_selected) > 0:
-                    raise ValueError(
-                        f"Tried to select columns "
-                        f'{", ".join(columns_not_previously_selected)} after already '
-                        f"filtering them out"
-                    )
-                curr_columns = next_columns
             select_clause = "SELECT " + ", ".join(
-                f'{_table_name_placeholder}."{c}"' for c in curr_columns
+                f'{table_name}."{c}"' for c in selected_columns
             )
 
         # filtering rows, aka where_clause
+        params = _QueryParameters()
+        if filter_column is None:
+            where_clause = "TRUE"  # TODO see if this causes performance issues
+        else:
+            where_clause = filter_column._construct_where_clause(
+                self, table_name, params
+            )
+
+        return select_clause, where_clause, params
+
+    def _selected_columns(self) -> Optional[Iterable[str]]:
+        """
+        Returns the columns selected by the user-supplied operations on this MdbTable,
+        or None if all columns should be selected
+        """
+        column_args = [
+            op.columns_to_select for op in self._ops if isinstance(op, _SelectColumnsOp)
+        ]
+        if len(column_args) == 0:
+            return None
+
+        curr_columns = column_args[0]
+        for next_columns in column_args[1:]:
+            columns_not_previously_selected = [
+                a for a in next_columns if a not in curr_columns
+            ]
+            if len(columns_not_previously_selected) > 0:
+                raise ValueError(
+                    f"Tried to select columns "
+                    f'{", ".join(columns_not_previously_selected)} after already '
+                    f"filtering them out"
+                )
+            curr_columns = next_columns
+        return curr_columns
+
+    def _filter_column(self) -> Optional[MdbBoolColumn]:
+        """
+        Combines all of the user-supplied row filters on this MdbTable into a single
+        simplified bool column, or returns None if there are no row filters
+        """
         row_args = [
             op.filter_column for op in self._ops if isinstance(op, _SelectRowsOp)
         ]
         if len(row_args) == 0:
-            where_clause = "TRUE"  # TODO see if this causes performance issues
-        else:
-            curr_filter_column = row_args[0]
-            for next_filter_column in row_args[1:]:
-                curr_filter_column = MdbComputedBoolColumnOpColumn(
-                    curr_filter_column, next_filter_column, "AND"
-                )
-            where_clause = row_args[0]._construct_where_clause(self)
+            return None
+
+        curr_filter_column: MdbBoolColumn = row_args[0]
+        for next_filter_column in row_args[1:]:
+            curr_filter_column = MdbComputedBoolColumnOpColumn(
+                curr_filter_column, next_filter_column, "AND"
+            )
+        return curr_filter_column._simplify()
+
+
+# Memoized results of MdbTable._construct_sql_uncached, keyed by the structure of the
+# operations rather than by MdbTable so that we don't keep tables alive, least recently
+# used first
+_SQL_CACHE_MAX_SIZE = 256
+_sql_cache: collections.OrderedDict[
+    Hashable, Tuple[str, str, _QueryParameters]
+] = collections.OrderedDict()
+_sql_cache_lock = threading.Lock()
+
+
+def _literal_cache_key(value: Any) -> Tuple[type, str]:
+    """
+    Returns a key for a literal for _sql_cache_key. The cached parameters come from the
+    first query with a matching key, so literals that compare equal in python but that
+    duckdb treats differently need different keys, e.g. 1, 1.0 and True, or the same
+    time in different timezones. We use the type and the repr rather than the value
+    itself to tell those apart.
+    """
+    return type(value), repr(value)
 
-        return select_clause, where_clause
+
+_T = TypeVar("_T")
 
 
 # The types of literals that can be used for comparisons.
@@ -430,6 +980,8 @@ class MdbColumn:
     _interpret_as_bool first, it's easier to not have it implement MdbBoolColumn.
     """
 
+    __slots__ = ("_mdb_table", "_column_name")
+
     def __init__(self, mdb_table: MdbTable, column_name: str):
         self._mdb_table = mdb_table
         self._column_name = column_name
@@ -485,7 +1037,7 @@ class MdbColumn:
     def _interpret_as_bool(self) -> MdbBoolColumn:
         # TODO check if this can actually be interpreted as a bool?
         return MdbComputedBoolColumnOpSingleArg(
-            self._mdb_table, self._column_name, "=", "TRUE"
+            self._mdb_table, self._column_name, "=", True
         )
 
     def __and__(self, other: MdbBoolColumn) -> MdbBoolColumn:
@@ -494,8 +1046,35 @@ class MdbColumn:
     def __or__(self, other: MdbBoolColumn) -> MdbBoolColumn:
         return MdbComputedBoolColumnOpColumn(self._interpret_as_bool(), other, "OR")
 
-    def _construct_where_clause(self, mdb_table: MdbTable) -> str:
-        return self._interpret_as_bool()._construct_where_clause(mdb_table)
+    def _construct_where_clause(
+        self, mdb_table: MdbTable, table_name: str, params: _QueryParameters
+    ) -> str:
+        return self._interpret_as_bool()._construct_where_clause(
+            mdb_table, table_name, params
+        )
+
+    def _to_sql_fragments(
+        self,
+        mdb_table: MdbTable,
+        table_name: str,
+        out: List[str],
+        params: _QueryParameters,
+    ) -> None:
+        self._interpret_as_bool()._to_sql_fragments(mdb_table, table_name, out, params)
+
+    def _simplify(self) -> MdbBoolColumn:
+        return self._interpret_as_bool()
+
+    def _compile_statistics_filter(
+        self, column_order: List[str]
+    ) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        return self._interpret_as_bool()._compile_statistics_filter(column_order)
+
+    def _referenced_columns(self, out: Set[str]) -> None:
+        self._interpret_as_bool()._referenced_columns(out)
+
+    def _sql_cache_key(self) -> Hashable:
+        return self._interpret_as_bool()._sql_cache_key()
 
     def to_pd(self) -> pd.Series:
         return self._mdb_table[[self._column_name]].to_pd()[self._column_name]
@@ -507,6 +1086,8 @@ class MdbBoolColumn(abc.ABC):
     columns
     """
 
+    __slots__ = ()
+
     @abc.abstractmethod
     def __invert__(self) -> MdbBoolColumn:
         pass
@@ -519,10 +1100,106 @@ class MdbBoolColumn(abc.ABC):
     def __or__(self, other: MdbBoolColumn) -> MdbBoolColumn:
         pass
 
+    def _construct_where_clause(
+        self, mdb_table: MdbTable, table_name: str, params: _QueryParameters
+    ) -> str:
+        out: List[str] = []
+        self._to_sql_fragments(mdb_table, table_name, out, params)
+        return "".join(out)
+
+    @abc.abstractmethod
+    def _to_sql_fragments(
+        self,
+        mdb_table: MdbTable,
+        table_name: str,
+        out: List[str],
+        params: _QueryParameters,
+    ) -> None:
+        """
+        Appends the SQL for this bool column to out. Building up a list of fragments
+        and joining them once avoids repeatedly copying strings for deeply nested
+        expressions.
+        """
+        pass
+
+    @abc.abstractmethod
+    def _compile_statistics_filter(
+        self, column_order: List[str]
+    ) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        """
+        Returns a function that takes two (n, len(column_order)) arrays of mins and
+        maxs (see _row_group_statistics), e.g. one row per parquet row group, and
+        returns a bool array of length n. False means that we can tell from the
+        statistics that no rows in that row group match this bool column, True means
+        that some rows might match. Compiling the filter once and evaluating it on all
+        of the row groups at once is much faster than walking the tree for each row
+        group.
+        """
+        pass
+
+    @abc.abstractmethod
+    def _referenced_columns(self, out: Set[str]) -> None:
+        """Adds the names of all of the columns that this bool column reads to out"""
+        pass
+
     @abc.abstractmethod
-    def _construct_where_clause(self, mdb_table: MdbTable) -> str:
+    def _sql_cache_key(self) -> Hashable:
+        """
+        Returns a hashable key such that bool columns with equal keys generate the same
+        sql and parameters, see MdbTable._construct_sql
+        """
         pass
 
+    def _simplify(self) -> MdbBoolColumn:
+        """
+        Returns an equivalent bool column, with any parts that we can tell are always
+        true or always false replaced by _MdbConstBoolColumn
+        """
+        return self
+
+
+class _MdbConstBoolColumn(MdbBoolColumn):
+    """
+    A bool column that is always True or always False. Only created by _simplify, not
+    directly by users.
+    """
+
+    __slots__ = ("_value",)
+
+    def __init__(self, value: bool):
+        self._value = value
+
+    def __invert__(self) -> MdbBoolColumn:
+        return _MdbConstBoolColumn(not self._value)
+
+    def __and__(self, other: MdbBoolColumn) -> MdbBoolColumn:
+        return MdbComputedBoolColumnOpColumn(self, other, "AND")
+
+    def __or__(self, other: MdbBoolColumn) -> MdbBoolColumn:
+        return MdbComputedBoolColumnOpColumn(self, other, "OR")
+
+    def _to_sql_fragments(
+        self,
+        mdb_table: MdbTable,
+        table_name: str,
+        out: List[str],
+        params: _QueryParameters,
+    ) -> None:
+        out.append("TRUE" if self._value else "FALSE")
+
+    def _compile_statistics_filter(
+        self, column_order: List[str]
+    ) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        import numpy as np
+
+        return lambda mins, maxs: np.full(len(mins), self._value)
+
+    def _referenced_columns(self, out: Set[str]) -> None:
+        pass
+
+    def _sql_cache_key(self) -> Hashable:
+        return "TRUE" if self._value else "FALSE"
+
 
 class MdbComputedBoolColumnOpArg(MdbBoolColumn, abc.ABC):
     """
@@ -530,6 +1207,8 @@ class MdbComputedBoolColumnOpArg(MdbBoolColumn, abc.ABC):
     3
     """
 
+    __slots__ = ("_mdb_table", "_column_name", "_op")
+
     def __init__(
         self,
         mdb_table: MdbTable,
@@ -546,13 +1225,44 @@ class MdbComputedBoolColumnOpArg(MdbBoolColumn, abc.ABC):
     def __or__(self, other: MdbBoolColumn) -> MdbBoolColumn:
         return MdbComputedBoolColumnOpColumn(self, other, "OR")
 
-    def _single_arg_to_string(self, arg: COMPARISON_LITERAL_TYPE) -> str:
-        # TODO this needs to be way more sophisticated, will rely on
-        #  self._mdb_table.table_schema
-        if isinstance(arg, str) or isinstance(arg, datetime.datetime):
-            return f"'{arg}'"
-        else:
-            return str(arg)
+    def _compile_statistics_filter(
+        self, column_order: List[str]
+    ) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        import numpy as np
+
+        if self._column_name not in column_order:
+            return lambda mins, maxs: np.ones(len(mins), dtype=bool)
+        j = column_order.index(self._column_name)
+
+        def statistics_filter(mins: np.ndarray, maxs: np.ndarray) -> np.ndarray:
+            column_mins, column_maxs = mins[:, j], maxs[:, j]
+            result = np.ones(len(mins), dtype=bool)
+            # if we don't have statistics, we can't tell
+            # elementwise comparison, so `is not None` won't work here
+            has_statistics = column_mins != None  # noqa: E711
+            try:
+                result[has_statistics] = self._can_match_min_max(
+                    column_mins[has_statistics], column_maxs[has_statistics]
+                )
+            except TypeError:
+                # e.g. comparing a string literal to a timestamp column, we can't tell
+                pass
+            return result
+
+        return statistics_filter
+
+    @abc.abstractmethod
+    def _can_match_min_max(
+        self, column_mins: np.ndarray, column_maxs: np.ndarray
+    ) -> np.ndarray:
+        """
+        column_mins and column_maxs are object arrays of the statistics for this
+        column. Returns a bool array, see _compile_statistics_filter.
+        """
+        pass
+
+    def _referenced_columns(self, out: Set[str]) -> None:
+        out.add(self._column_name)
 
     def _assert_table_version_is_same(self, mdb_table: MdbTable) -> None:
         if self._mdb_table._version_number != mdb_table._version_number:
@@ -568,6 +1278,8 @@ class MdbComputedBoolColumnOpSingleArg(MdbComputedBoolColumnOpArg):
     argument e.g. t['column1'] == 3
     """
 
+    __slots__ = ("_arg",)
+
     def __init__(
         self,
         mdb_table: MdbTable,
@@ -598,12 +1310,48 @@ class MdbComputedBoolColumnOpSingleArg(MdbComputedBoolColumnOpArg):
             self._mdb_table, self._column_name, new_op, self._arg
         )
 
-    def _construct_where_clause(self, mdb_table: MdbTable) -> str:
+    def _can_match_min_max(
+        self, column_mins: np.ndarray, column_maxs: np.ndarray
+    ) -> np.ndarray:
+        arg = self._arg
+        if self._op == "=":
+            return (column_mins <= arg) & (column_maxs >= arg)
+        elif self._op == "!=":
+            # NaNs aren't included in statistics, and NaN != arg
+            return _is_float(column_mins) | ~(
+                (column_mins == arg) & (column_maxs == arg)
+            )
+        elif self._op == ">":
+            return column_maxs > arg
+        elif self._op == ">=":
+            return column_maxs >= arg
+        elif self._op == "<":
+            return column_mins < arg
+        elif self._op == "<=":
+            return column_mins <= arg
+        else:
+            raise ValueError(f"Programming error: op {self._op} is not covered")
+
+    def _to_sql_fragments(
+        self,
+        mdb_table: MdbTable,
+        table_name: str,
+        out: List[str],
+        params: _QueryParameters,
+    ) -> None:
         self._assert_table_version_is_same(mdb_table)
 
+        out.append(
+            f'({table_name}."{self._column_name}" {self._op} '
+            f"{params.add_value(self._arg)})"
+        )
+
+    def _sql_cache_key(self) -> Hashable:
         return (
-            f'({_table_name_placeholder}."{self._column_name}" {self._op} '
-            f"{self._single_arg_to_string(self._arg)})"
+            self._mdb_table._version_number,
+            self._column_name,
+            self._op,
+            _literal_cache_key(self._arg),
         )
 
 
@@ -613,6 +1361,8 @@ class MdbComputedBoolColumnOpTwoArgs(MdbComputedBoolColumnOpArg):
     e.g. t['column1'],between(0, 3)
     """
 
+    __slots__ = ("_arg",)
+
     def __init__(
         self,
         mdb_table: MdbTable,
@@ -635,13 +1385,39 @@ class MdbComputedBoolColumnOpTwoArgs(MdbComputedBoolColumnOpArg):
             self._mdb_table, self._column_name, new_op, self._arg
         )
 
-    def _construct_where_clause(self, mdb_table: MdbTable) -> str:
+    def _can_match_min_max(
+        self, column_mins: np.ndarray, column_maxs: np.ndarray
+    ) -> np.ndarray:
+        a, b = self._arg
+        if self._op == "BETWEEN":
+            return (column_maxs >= a) & (column_mins <= b)
+        elif self._op == "NOT BETWEEN":
+            # NaNs aren't included in statistics, and NaN is never between a and b
+            return _is_float(column_mins) | ~((column_mins >= a) & (column_maxs <= b))
+        else:
+            raise ValueError(f"Programming error: op {self._op} is not covered")
+
+    def _to_sql_fragments(
+        self,
+        mdb_table: MdbTable,
+        table_name: str,
+        out: List[str],
+        params: _QueryParameters,
+    ) -> None:
         self._assert_table_version_is_same(mdb_table)
 
+        out.append(
+            f'({table_name}."{self._column_name}" {self._op} '
+            f"{params.add_value(self._arg[0])} AND "
+            f"{params.add_value(self._arg[1])})"
+        )
+
+    def _sql_cache_key(self) -> Hashable:
         return (
-            f'({_table_name_placeholder}."{self._column_name}" {self._op} '
-            f"{self._single_arg_to_string(self._arg[0])} AND "
-            f"{self._single_arg_to_string(self._arg[1])})"
+            self._mdb_table._version_number,
+            self._column_name,
+            self._op,
+            tuple(_literal_cache_key(a) for a in self._arg),
         )
 
 
@@ -651,6 +1427,8 @@ class MdbComputedBoolColumnOpManyArgs(MdbComputedBoolColumnOpArg):
     e.g. t['column1'].isin(1,2,3)
     """
 
+    __slots__ = ("_arg",)
+
     def __init__(
         self,
         mdb_table: MdbTable,
@@ -659,7 +1437,8 @@ class MdbComputedBoolColumnOpManyArgs(MdbComputedBoolColumnOpArg):
         arg: Iterable[COMPARISON_LITERAL_TYPE],
     ):
         super().__init__(mdb_table, column_name, op)
-        self._arg = arg
+        # arg could be a generator, and we need to iterate over it more than once
+        self._arg = tuple(arg)
 
     def __invert__(self) -> MdbComputedBoolColumnOpManyArgs:
         if self._op == "IN":
@@ -673,12 +1452,95 @@ class MdbComputedBoolColumnOpManyArgs(MdbComputedBoolColumnOpArg):
             self._mdb_table, self._column_name, new_op, self._arg
         )
 
-    def _construct_where_clause(self, mdb_table: MdbTable) -> str:
+    def _simplify(self) -> MdbBoolColumn:
+        if len(self._arg) == 0:
+            # isin([]) is always False
+            return _MdbConstBoolColumn(self._op == "NOT IN")
+        return self
+
+    def _can_match_min_max(
+        self, column_mins: np.ndarray, column_maxs: np.ndarray
+    ) -> np.ndarray:
+        import numpy as np
+
+        # Sorting the args lets us binary search for each min/max rather than comparing
+        # against every arg. NaNs can't be sorted, but they also can't be in the
+        # statistics, so we can leave them out.
+        args = np.array(sorted(arg for arg in self._arg if arg == arg), dtype=object)
+        if self._op == "IN":
+            # some arg is between the min and the max
+            return np.searchsorted(args, column_mins, "left") < np.searchsorted(
+                args, column_maxs, "right"
+            )
+        elif self._op == "NOT IN":
+            # NaNs aren't included in statistics, and NaN is never in self._arg
+            if len(args) == 0:
+                return np.ones(len(column_mins), dtype=bool)
+            i = np.minimum(np.searchsorted(args, column_mins), len(args) - 1)
+            return _is_float(column_mins) | ~(
+                (column_mins == column_maxs) & (args[i] == column_mins)
+            )
+        else:
+            raise ValueError(f"Programming error: op {self._op} is not covered")
+
+    def _to_sql_fragments(
+        self,
+        mdb_table: MdbTable,
+        table_name: str,
+        out: List[str],
+        params: _QueryParameters,
+    ) -> None:
         self._assert_table_version_is_same(mdb_table)
 
+        if self._op not in ("IN", "NOT IN"):
+            raise ValueError(f"Programming error: op {self._op} is not covered")
+
+        if len(self._arg) >= _IN_TABLE_MIN_ITEMS:
+            # For long lists, an arrow table lets duckdb do a hash join against the
+            # list, and keeps the SQL small
+            import pyarrow
+
+            try:
+                values_table = pyarrow.table({"v": self._arg})
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+                # e.g. the list has mixed types, fall back on parameters below
+                pass
+            else:
+                out.append(
+                    f'({table_name}."{self._column_name}" {self._op} '
+                    f"(SELECT v FROM "
+                    f"{params.add_table(self._column_name, values_table)}))"
+                )
+                return
+
+        # We need a separate parameter for each item (rather than e.g. passing the
+        # whole list to = ANY(?)) so that duckdb casts each item to the type of the
+        # column, e.g. so that strings can be compared to timestamps
+        column = f'{table_name}."{self._column_name}"'
+        if self._op == "IN":
+            out.append(
+                f"({column} IN ("
+                + ", ".join(params.add_value(arg) for arg in self._arg)
+                + "))"
+            )
+        else:
+            # x NOT IN (a, b) is equivalent to x != a AND x != b. duckdb (as of 0.8.1)
+            # doesn't cast parameters in a NOT IN list to the type of the column, so
+            # spell it out.
+            out.append(
+                "("
+                + " AND ".join(
+                    f"{column} != {params.add_value(arg)}" for arg in self._arg
+                )
+                + ")"
+            )
+
+    def _sql_cache_key(self) -> Hashable:
         return (
-            f'({_table_name_placeholder}."{self._column_name}" {self._op} '
-            f'({", ".join(self._single_arg_to_string(arg) for arg in self._arg)}))'
+            self._mdb_table._version_number,
+            self._column_name,
+            self._op,
+            tuple(_literal_cache_key(a) for a in self._arg),
         )
 
 
@@ -688,6 +1550,8 @@ class MdbComputedBoolColumnOpColumn(MdbBoolColumn):
     >>> (t['column1'] == 3) & (t['column2'] < 10)
     """
 
+    __slots__ = ("_series_a", "_series_b", "_op")
+
     def __init__(
         self, series_a: MdbBoolColumn, series_b: MdbBoolColumn, op: Literal["AND", "OR"]
     ):
@@ -711,8 +1575,162 @@ class MdbComputedBoolColumnOpColumn(MdbBoolColumn):
         else:
             raise ValueError(f"Programming error: self._op cannot be {self._op}")
 
-    def _construct_where_clause(self, mdb_table: MdbTable) -> str:
-        return (
-            f"({self._series_a._construct_where_clause(mdb_table)} {self._op} "
-            f"{self._series_b._construct_where_clause(mdb_table)})"
+    def _fold(
+        self,
+        leaf: Callable[[MdbBoolColumn], _T],
+        combine: Callable[[MdbComputedBoolColumnOpColumn, _T, _T], _T],
+    ) -> _T:
+        """
+        Calls leaf on every node in this tree that isn't an
+        MdbComputedBoolColumnOpColumn, and then combines the results from the bottom up
+        with combine. Like _to_sql_fragments, this uses an explicit stack rather than
+        recursing.
+        """
+        results: List[_T] = []
+        stack: List[Tuple[MdbBoolColumn, bool]] = [(self, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if not isinstance(node, MdbComputedBoolColumnOpColumn):
+                results.append(leaf(node))
+            elif children_done:
+                result_b = results.pop()
+                result_a = results.pop()
+                results.append(combine(node, result_a, result_b))
+            else:
+                stack.append((node, True))
+                stack.append((node._series_b, False))
+                stack.append((node._series_a, False))
+        return results[0]
+
+    def _simplify(self) -> MdbBoolColumn:
+        return self._fold(
+            lambda column: column._simplify(),
+            MdbComputedBoolColumnOpColumn._simplify_node,
         )
+
+    def _simplify_node(
+        self, series_a: MdbBoolColumn, series_b: MdbBoolColumn
+    ) -> MdbBoolColumn:
+        """
+        Simplifies this node, given the already-simplified versions of its children
+        """
+        if isinstance(series_a, _MdbConstBoolColumn) or isinstance(
+            series_b, _MdbConstBoolColumn
+        ):
+            if isinstance(series_b, _MdbConstBoolColumn):
+                series_a, series_b = series_b, series_a
+            assert isinstance(series_a, _MdbConstBoolColumn)
+            if self._op == "AND":
+                # FALSE AND x = FALSE, TRUE AND x = x
+                return series_b if series_a._value else series_a
+            elif self._op == "OR":
+                # TRUE OR x = TRUE, FALSE OR x = x
+                return series_a if series_a._value else series_b
+            else:
+                raise ValueError(f"Programming error: self._op cannot be {self._op}")
+
+        if (
+            self._op == "AND"
+            and isinstance(series_a, MdbComputedBoolColumnOpSingleArg)
+            and isinstance(series_b, MdbComputedBoolColumnOpSingleArg)
+            and series_a._column_name == series_b._column_name
+            and series_a._op == "="
+            and series_b._op == "="
+            # Different literals can compare equal after duckdb casts them to the
+            # type of the column, e.g. "2" and "02" on an int column, so we only do
+            # this for literals of the same numeric type. NaN = NaN in duckdb.
+            and type(series_a._arg) is type(series_b._arg)
+            and type(series_a._arg) in (int, float, bool)
+            and series_a._arg == series_a._arg
+            and series_b._arg == series_b._arg
+            and series_a._arg != series_b._arg
+        ):
+            # col = x AND col = y is always False if x != y
+            return _MdbConstBoolColumn(False)
+
+        if series_a is self._series_a and series_b is self._series_b:
+            return self
+        return MdbComputedBoolColumnOpColumn(series_a, series_b, self._op)
+
+    def _referenced_columns(self, out: Set[str]) -> None:
+        self._fold(
+            lambda column: column._referenced_columns(out), lambda node, a, b: None
+        )
+
+    def _sql_cache_key(self) -> Hashable:
+        # A flat list of the keys in post-order rather than nested tuples, as hashing
+        # nested tuples recurses
+        keys: List[Hashable] = []
+        self._fold(
+            lambda column: keys.append(column._sql_cache_key()),
+            lambda node, a, b: keys.append(node._op),
+        )
+        return tuple(keys)
+
+    def _compile_statistics_filter(
+        self, column_order: List[str]
+    ) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        # Flatten this tree into a list of steps in post-order, i.e. a program for a
+        # stack machine. Evaluating that with a loop (rather than composing closures)
+        # means that deeply nested trees don't hit the recursion limit.
+        steps: List[Union[str, Callable[[np.ndarray, np.ndarray], np.ndarray]]] = []
+        self._fold(
+            lambda column: steps.append(
+                column._compile_statistics_filter(column_order)
+            ),
+            lambda node, a, b: steps.append(node._op),
+        )
+
+        def statistics_filter(mins: np.ndarray, maxs: np.ndarray) -> np.ndarray:
+            results: List[np.ndarray] = []
+            for step in steps:
+                if step == "AND":
+                    result_b = results.pop()
+                    results.append(results.pop() & result_b)
+                elif step == "OR":
+                    result_b = results.pop()
+                    results.append(results.pop() | result_b)
+                elif callable(step):
+                    results.append(step(mins, maxs))
+                else:
+                    raise ValueError(f"Programming error: op {step} is not covered")
+            return results[0]
+
+        return statistics_filter
+
+    def _to_sql_fragments(
+        self,
+        mdb_table: MdbTable,
+        table_name: str,
+        out: List[str],
+        params: _QueryParameters,
+    ) -> None:
+        # Walk the tree with an explicit stack rather than recursing, as long chains of
+        # & and | can get very deep. Items are pushed in reverse order so that they get
+        # popped (and therefore appended to out) in order. Each column is pushed with
+        # the op of its parent: AND and OR are associative, so when a child has the
+        # same op as its parent we leave out the parentheses, e.g. (a OR b OR c) rather
+        # than (a OR (b OR c)). This keeps the SQL flat enough for duckdb's parser.
+        stack: List[Union[str, Tuple[MdbBoolColumn, Optional[str]]]] = [(self, None)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                out.append(item)
+                continue
+
+            column, parent_op = item
+            if isinstance(column, MdbComputedBoolColumnOpColumn):
+                parenthesize = column._op != parent_op
+                if parenthesize:
+                    stack.append(")")
+                stack.extend(
+                    (
+                        (column._series_b, column._op),
+                        f" {column._op} ",
+                        (column._series_a, column._op),
+                    )
+                )
+                if parenthesize:
+                    stack.append("(")
+            else:
+                column._to_sql_fragments(mdb_table, table_name, out, params)
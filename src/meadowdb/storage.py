@@ -1,9 +1,14 @@
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
-from typing import Any
-import duckdb
-import pandas as pd
+import functools
+import pickle
+from typing import TYPE_CHECKING, Any, Tuple
 import os
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 Key = str
 
 
@@ -22,14 +27,21 @@ class KeyValueStore(ABC):
     def get_pickle(self, key: Key) -> Any:
         ...
 
+    @abstractmethod
+    def get_pickle_cached(self, key: Key) -> Any:
+        """
+        Like get_pickle, but may return the same object for repeated calls, so the
+        caller must not modify the returned object.
+        """
+        ...
+
     @abstractmethod
     def set_parquet(self, key: Key, value: pd.DataFrame) -> None:
         ...
 
     @abstractmethod
-    def get_parquet_duckdb_relation(
-        self, key: Key, conn: duckdb.DuckDBPyConnection
-    ) -> duckdb.DuckDBPyRelation:
+    def get_parquet_duckdb_path(self, key: Key) -> str:
+        """Returns a path that can be passed to duckdb's read_parquet"""
         ...
 
 
@@ -52,15 +64,30 @@ class FileSystemStore(KeyValueStore):
         return os.path.exists(self._full_path(key))
 
     def set_pickle(self, key: Key, value: Any) -> None:
-        pd.to_pickle(value, self._full_path(key))
+        with open(self._full_path(key), "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
 
     def get_pickle(self, key: Key) -> Any:
-        return pd.read_pickle(self._full_path(key))
+        with open(self._full_path(key), "rb") as f:
+            return pickle.load(f)
+
+    def get_pickle_cached(self, key: Key) -> Any:
+        path = self._full_path(key)
+        stat = os.stat(path)
+        return _load_pickle(path, (stat.st_mtime_ns, stat.st_size))
 
     def set_parquet(self, key: Key, df: pd.DataFrame) -> None:
         df.to_parquet(self._full_path(key), index=False)
 
-    def get_parquet_duckdb_relation(
-        self, key: Key, conn: duckdb.DuckDBPyConnection
-    ) -> duckdb.DuckDBPyRelation:
-        return conn.from_parquet(self._full_path(key))
+    def get_parquet_duckdb_path(self, key: Key) -> str:
+        return self._full_path(key)
+
+
+@functools.lru_cache(maxsize=128)
+def _load_pickle(path: str, stat_key: Tuple[int, int]) -> Any:
+    """
+    stat_key should be (mtime, size) of path, so that we'll reload the file if it gets
+    modified
+    """
+    with open(path, "rb") as f:
+        return pickle.load(f)
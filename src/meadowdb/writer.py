@@ -1,7 +1,7 @@
-import uuid
-from typing import Optional
+from __future__ import annotations
 
-import pandas as pd
+import uuid
+from typing import TYPE_CHECKING, Optional
 
 from meadowdb.readerwriter_shared import (
     DeleteAllLogEntry,
@@ -12,6 +12,9 @@ from meadowdb.readerwriter_shared import (
 )
 from meadowdb.table_versions_client_local import TableVersionsClientLocal
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 def write(
     table_versions_client: TableVersionsClientLocal,
@@ -1,6 +1,11 @@
+import copy
+import datetime
+import functools
 from typing import Callable
 import meadowdb
+import numpy as np
 import pandas as pd
+import pickle
 import unittest.mock
 from meadowdb.connection import (
     _MEADOWDB_DEFAULT_USERSPACE,
@@ -23,6 +28,7 @@ def test_meadowdb(
     test_data1.loc[50, "str1"] = "hello"
     test_data1.loc[51, "str1"] = "foobar"
     test_data1.loc[52, "str1"] = "foobar"
+    test_data1.loc[53, "str1"] = "it's"
     test_data2 = random_df()
     test_data3 = random_df()
     mdb.write(table, test_data1)
@@ -56,6 +62,26 @@ def test_meadowdb(
             )
         )
     )
+    # literals are passed as parameters so they don't need to be escaped
+    assert (
+        t[t["str1"].isin(["it's", "hello"])]
+        .to_pd()
+        .equals(
+            test_data_combined[
+                test_data_combined["str1"].isin(["it's", "hello"])
+            ].reset_index(drop=True)
+        )
+    )
+    # multiple row filters should all get applied
+    assert (
+        t[t["int1"] < 500][t["int2"] > 500]
+        .to_pd()
+        .equals(
+            test_data_combined[
+                (test_data_combined["int1"] < 500) & (test_data_combined["int2"] > 500)
+            ].reset_index(drop=True)
+        )
+    )
     timestamp_filter_result = test_data_combined[
         test_data_combined["timestamp1"].between("2011-01-01", "2011-02-01")
     ].reset_index(drop=True)
@@ -185,8 +211,17 @@ def test_meadowdb_duplication_keys(random_df, mdb_connection: meadowdb.Connectio
     mdb.delete_where_equal("temp2", pd.DataFrame({"str1": ["hello"]}))
 
     t = mdb.read("temp2")
-    assert t.to_pd().equals(
-        test_data_combined[test_data_combined["str1"] != "hello"].reset_index(drop=True)
+    test_data_deleted = test_data_combined[
+        test_data_combined["str1"] != "hello"
+    ].reset_index(drop=True)
+    assert t.to_pd().equals(test_data_deleted)
+
+    # selecting a subset of columns still needs to read the deduplication keys, delete
+    # columns, and filter columns
+    assert (
+        t[t["int2"] > 500][["float1"]]
+        .to_pd()
+        .equals(t[t["int2"] > 500].to_pd()[["float1"]])
     )
 
     test_data4 = random_df(1)
@@ -212,6 +247,21 @@ def test_meadowdb_duplication_keys(random_df, mdb_connection: meadowdb.Connectio
     assert len(t.to_pd()) == 0
 
 
+def test_meadowdb_duplication_keys_nulls(mdb_connection: meadowdb.Connection):
+    mdb = mdb_connection
+    table = "temp17"
+    mdb.create_or_update_table_schema(table, meadowdb.TableSchema(None, ["k"]))
+    mdb.write(table, pd.DataFrame({"k": [1.0, None], "v": [1, 2]}))
+    mdb.write(table, pd.DataFrame({"k": [1.0, None], "v": [3, 4]}))
+
+    # rows with null deduplication keys don't overwrite each other
+    assert (
+        mdb.read(table)
+        .to_pd()
+        .equals(pd.DataFrame({"k": [None, 1.0, None], "v": [2, 3, 4]}))
+    )
+
+
 def test_meadowdb_userspace(
     random_df: Callable[[], pd.DataFrame], mdb_connection: meadowdb.Connection
 ):
@@ -317,3 +367,362 @@ def test_single_userspace_spec_via_env_var(
         )
         assert mdb.read(table_name, UserspaceSpec(tip="test2")).to_pd().equals(df2)
         assert mdb.read(table_name, UserspaceSpec.main()).to_pd().equals(main_data)
+
+
+def test_meadowdb_statistics(
+    random_df: Callable[..., pd.DataFrame], mdb_connection: meadowdb.Connection
+):
+    # each write covers a disjoint range of int1, so most filters will let us skip
+    # some of the writes based on their parquet statistics
+    mdb = mdb_connection
+    table = "temp4"
+    dfs = []
+    for i in range(3):
+        df = random_df()
+        df["int1"] = df["int1"] + i * 1000
+        mdb.write(table, df)
+        dfs.append(df)
+    combined = pd.concat(dfs, ignore_index=True)
+    t = mdb.read(table)
+
+    # the compiled filter evaluates the statistics for many row groups at once
+    f = (t["int1"] < 1000)._compile_statistics_filter(["int1"])
+    mins = np.array([[0], [1000]], dtype=object)
+    maxs = np.array([[999], [1999]], dtype=object)
+    assert list(f(mins, maxs)) == [True, False]
+    # no statistics for int1
+    f = (t["int1"] < 1000)._compile_statistics_filter(["int2"])
+    assert list(f(mins, maxs)) == [True, True]
+    f = (~t["int1"].isin([5]))._compile_statistics_filter(["int1"])
+    mins = np.array([[5], [5]], dtype=object)
+    maxs = np.array([[6], [5]], dtype=object)
+    assert list(f(mins, maxs)) == [True, False]
+
+    statistics_filter = (
+        (t["int1"] < 1000) | t["str1"].isin(["a", "b"])
+    )._compile_statistics_filter(["int1", "str1"])
+    mins = np.array([[0, "c"], [1000, "a"], [1000, "c"], [None, None]], dtype=object)
+    maxs = np.array([[999, "d"], [1999, "a"], [1999, "d"], [None, None]], dtype=object)
+    assert list(statistics_filter(mins, maxs)) == [True, True, False, True]
+
+    for mdb_filter, pd_filter in [
+        (t["int1"] < 1000, combined["int1"] < 1000),
+        (t["int1"] >= 2000, combined["int1"] >= 2000),
+        (t["int1"].between(1100, 1200), combined["int1"].between(1100, 1200)),
+        (t["int1"].isin([5, 2005]), combined["int1"].isin([5, 2005])),
+        (
+            (t["int1"] < 1000) | (t["int1"] > 2500),
+            (combined["int1"] < 1000) | (combined["int1"] > 2500),
+        ),
+        (t["int1"] > 5000, combined["int1"] > 5000),
+        # long lists get passed to duckdb as a table
+        (t["int1"].isin(range(0, 3000, 7)), combined["int1"].isin(range(0, 3000, 7))),
+        (
+            ~t["str1"].isin(combined["str1"][:150]),
+            ~combined["str1"].isin(combined["str1"][:150]),
+        ),
+    ]:
+        assert t[mdb_filter].to_pd().equals(combined[pd_filter].reset_index(drop=True))
+
+
+def test_meadowdb_constant_filters(
+    random_df: Callable[..., pd.DataFrame], mdb_connection: meadowdb.Connection
+):
+    mdb = mdb_connection
+    table = "temp5"
+    df = random_df()
+    mdb.write(table, df)
+    t = mdb.read(table)
+
+    # these filters can never be true, so we shouldn't even need to read the data,
+    # but we should still get the same columns and dtypes as a filter that happens to
+    # not match anything
+    no_match = t[t["int1"] < -(10**9)]
+    assert t[t["int1"].isin([])].to_pd().dtypes.equals(no_match.to_pd().dtypes)
+    assert (
+        t[t["int1"].isin([])][["str1", "int1"]]
+        .to_pd()
+        .dtypes.equals(no_match[["str1", "int1"]].to_pd().dtypes)
+    )
+    assert len(t[(t["int1"] == 1) & (t["int1"] == 2)].to_pd()) == 0
+    # but different literals that duckdb casts to the same value aren't always false
+    i = df["int1"][0].item()
+    assert len(t[(t["int1"] == str(i)) & (t["int1"] == f"0{i}")].to_pd()) == len(
+        df[df["int1"] == i]
+    )
+    timestamp = df["timestamp1"][0]
+    assert len(
+        t[
+            (t["timestamp1"] == timestamp.strftime("%Y-%m-%d"))
+            & (t["timestamp1"] == timestamp.strftime("%Y-%m-%d %H:%M:%S"))
+        ].to_pd()
+    ) == len(df[df["timestamp1"] == timestamp])
+    assert len(t[t["int1"].isin([]) & (t["int2"] > 5)].to_pd()) == 0
+
+    # and these are always true
+    assert t[~t["int1"].isin([])].to_pd().equals(df)
+    assert (
+        t[t["int1"].isin([]) | (t["int2"] > 500)]
+        .to_pd()
+        .equals(df[df["int2"] > 500].reset_index(drop=True))
+    )
+
+
+def test_meadowdb_memoized_sql(
+    random_df: Callable[..., pd.DataFrame], mdb_connection: meadowdb.Connection
+):
+    mdb = mdb_connection
+    table = "temp9"
+    df = random_df()
+    mdb.write(table, df)
+    t = mdb.read(table)
+
+    # the same ops on the same version of the table reuse the same sql, even if they
+    # were constructed separately, e.g. re-running a cell in a notebook
+    t1 = t[t["int1"] > 5][["int1", "str1"]]
+    t2 = t[t["int1"] > 5][["int1", "str1"]]
+    assert t1._construct_sql("t")[1:] == t2._construct_sql("t")[1:]
+    assert t1._construct_sql("t")[3] is t2._construct_sql("t")[3]
+    assert t1.to_pd().equals(t2.to_pd())
+
+    # different ops or literals of different types get different sql
+    t3 = t[t["int1"] > 6][["int1", "str1"]]
+    assert t1._construct_sql("t")[3] is not t3._construct_sql("t")[3]
+    t4 = t[t["int1"] > 5.0][["int1", "str1"]]
+    assert t1._construct_sql("t")[3] is not t4._construct_sql("t")[3]
+    assert t4._construct_sql("t")[3].values == [5.0]
+    assert type(t4._construct_sql("t")[3].values[0]) is float
+
+    # literals that compare equal but that duckdb treats differently don't share
+    # parameters
+    a = pd.Timestamp("2011-01-01 05:00", tz="UTC")
+    b = pd.Timestamp("2011-01-01 00:00", tz="US/Eastern")
+    assert a == b
+    assert t[t["timestamp1"] == a]._construct_sql("t")[3].values[0] is a
+    assert t[t["timestamp1"] == b]._construct_sql("t")[3].values[0] is b
+
+
+def test_meadowdb_pickle(
+    random_df: Callable[..., pd.DataFrame], mdb_connection: meadowdb.Connection
+):
+    mdb = mdb_connection
+    table = "temp16"
+    df = random_df()
+    mdb.write(table, df)
+    t = mdb.read(table)
+
+    # filtered and projected tables can be pickled and copied
+    t1 = t[(t["int1"] > 500) | t["str1"].isin(["hello"])][["int1", "str1"]]
+    expected = t1.to_pd()
+    assert pickle.loads(pickle.dumps(t1)).to_pd().equals(expected)
+    assert copy.deepcopy(t1).to_pd().equals(expected)
+
+
+def test_meadowdb_categoricals(
+    random_df: Callable[..., pd.DataFrame], mdb_connection: meadowdb.Connection
+):
+    mdb = mdb_connection
+    table = "temp6"
+    df1 = random_df()
+    df1["str1"] = df1["str1"].astype("category")
+    df2 = random_df()
+    df2["str1"] = df2["str1"].astype("category")
+    mdb.write(table, df1)
+    mdb.write(table, df2)
+
+    t = mdb.read(table)
+    result = t.to_pd()
+    assert result["str1"].dtype == "category"
+    assert t[t["int1"].isin([])].to_pd()["str1"].dtype == "category"
+    assert (
+        result["str1"]
+        .astype(str)
+        .equals(pd.concat([df1, df2], ignore_index=True)["str1"].astype(str))
+    )
+
+
+def test_meadowdb_dtypes(mdb_connection: meadowdb.Connection):
+    mdb = mdb_connection
+    table = "temp14"
+    mdb.write(
+        table,
+        pd.DataFrame(
+            {
+                "date1": [datetime.date(2011, 1, 1), datetime.date(2011, 1, 2)],
+                "bool1": [True, None],
+                "str1": ["a", None],
+            }
+        ),
+    )
+
+    result = mdb.read(table).to_pd()
+    # dates come back as datetime64 and nulls in object columns come back as NaN
+    assert result["date1"].dtype == "datetime64[ns]"
+    assert result["date1"].dt.day.tolist() == [1, 2]
+    assert result["bool1"][0] is True and np.isnan(result["bool1"][1])
+    assert result["str1"][0] == "a" and np.isnan(result["str1"][1])
+
+
+def test_meadowdb_deep_filters(
+    random_df: Callable[..., pd.DataFrame], mdb_connection: meadowdb.Connection
+):
+    mdb = mdb_connection
+    table = "temp7"
+    df = random_df()
+    mdb.write(table, df)
+    t = mdb.read(table)
+
+    # e.g. from functools.reduce, this should be deeper than the recursion limit
+    values = list(range(0, 1000, 3))
+    mdb_filter = functools.reduce(
+        lambda a, b: a | b, [t["int1"] == i for i in values * 10]
+    )
+    assert (
+        t[mdb_filter & (t["int2"] > 500)]
+        .to_pd()
+        .equals(df[df["int1"].isin(values) & (df["int2"] > 500)].reset_index(drop=True))
+    )
+
+
+def test_meadowdb_deletes_different_columns(
+    random_df: Callable[..., pd.DataFrame], mdb_connection: meadowdb.Connection
+):
+    mdb = mdb_connection
+    table = "temp8"
+    df = random_df()
+    mdb.write(table, df)
+    mdb.delete_where_equal(table, pd.DataFrame({"int1": [df["int1"][0]]}))
+    mdb.delete_where_equal(table, pd.DataFrame({"int1": [df["int1"][1]]}))
+    assert (
+        mdb.read(table)
+        .to_pd()
+        .equals(df[~df["int1"].isin(df["int1"][:2])].reset_index(drop=True))
+    )
+
+    mdb.delete_where_equal(table, pd.DataFrame({"str1": ["hello"]}))
+    with pytest.raises(NotImplementedError):
+        mdb.read(table).to_pd()
+
+
+def test_meadowdb_isin_timestamps(
+    random_df: Callable[..., pd.DataFrame], mdb_connection: meadowdb.Connection
+):
+    mdb = mdb_connection
+    table = "temp10"
+    df = random_df()
+    mdb.write(table, df)
+    t = mdb.read(table)
+
+    # string literals get cast to the type of the column
+    dates = ["2011-01-02", "2011-01-03"]
+    assert (
+        t[t["timestamp1"].isin(dates)]
+        .to_pd()
+        .equals(df[df["timestamp1"].isin(pd.to_datetime(dates))].reset_index(drop=True))
+    )
+    assert (
+        t[~t["timestamp1"].isin(dates)]
+        .to_pd()
+        .equals(
+            df[~df["timestamp1"].isin(pd.to_datetime(dates))].reset_index(drop=True)
+        )
+    )
+
+    # long lists are passed as arrow tables, which also need to be cast
+    dates = [str(d.date()) for d in pd.date_range("2011-01-02", periods=200, freq="2D")]
+    assert (
+        t[t["timestamp1"].isin(dates)]
+        .to_pd()
+        .equals(df[df["timestamp1"].isin(pd.to_datetime(dates))].reset_index(drop=True))
+    )
+    assert (
+        t[~t["timestamp1"].isin(dates)]
+        .to_pd()
+        .equals(
+            df[~df["timestamp1"].isin(pd.to_datetime(dates))].reset_index(drop=True)
+        )
+    )
+
+
+def test_meadowdb_numpy_literals(
+    random_df: Callable[..., pd.DataFrame], mdb_connection: meadowdb.Connection
+):
+    mdb = mdb_connection
+    table = "temp15"
+    df = random_df()
+    mdb.write(table, df)
+    t = mdb.read(table)
+
+    # numpy scalars, e.g. from indexing into a dataframe, work like python literals
+    assert (
+        t[t["int1"] == df["int1"][3]]
+        .to_pd()
+        .equals(df[df["int1"] == df["int1"][3]].reset_index(drop=True))
+    )
+    values = df["int1"].values[:2]
+    assert (
+        t[t["int1"].isin(values)]
+        .to_pd()
+        .equals(df[df["int1"].isin(values)].reset_index(drop=True))
+    )
+    assert (
+        t[t["int1"].between(np.int64(100), np.int64(400))]
+        .to_pd()
+        .equals(df[df["int1"].between(100, 400)].reset_index(drop=True))
+    )
+    timestamp = df["timestamp1"].values[3]
+    assert (
+        t[t["timestamp1"] == timestamp]
+        .to_pd()
+        .equals(df[df["timestamp1"] == timestamp].reset_index(drop=True))
+    )
+
+
+def test_meadowdb_reserved_column_names(
+    random_df: Callable[..., pd.DataFrame], mdb_connection: meadowdb.Connection
+):
+    mdb = mdb_connection
+    table = "temp11"
+    # duckdb's read_parquet uses these column names for its own purposes
+    df1 = random_df()
+    df1["filename"] = df1["str1"]
+    df1["file_row_number"] = df1["int2"]
+    df2 = random_df()
+    mdb.write(table, df1)
+    mdb.write(table, df2)
+    mdb.delete_where_equal(table, pd.DataFrame({"filename": [df1["filename"][0]]}))
+    t = mdb.read(table)
+
+    combined = pd.concat([df1[1:], df2], ignore_index=True)
+    assert t.to_pd().equals(combined)
+    assert (
+        t[t["file_row_number"] > 500][["filename", "int1"]]
+        .to_pd()
+        .equals(
+            combined[combined["file_row_number"] > 500][
+                ["filename", "int1"]
+            ].reset_index(drop=True)
+        )
+    )
+
+
+def test_meadowdb_skipped_writes_schema(mdb_connection: meadowdb.Connection):
+    mdb = mdb_connection
+
+    # skipping the older write must not drop its columns
+    table = "temp12"
+    mdb.write(table, pd.DataFrame({"a": [1, 2, 3], "b": [4, 5, 6]}))
+    mdb.write(table, pd.DataFrame({"a": [7, 8, 9]}))
+    t = mdb.read(table)
+    assert list(t[t["a"] > 5].to_pd().columns) == ["a", "b"]
+    assert list(t[t["a"] > 0].to_pd().columns) == ["a", "b"]
+    # and neither must a filter that can never be true
+    assert t[t["a"].isin([])].to_pd().dtypes.equals(t[t["a"] > 100].to_pd().dtypes)
+
+    # skipping the older write must not change the types of the columns
+    table = "temp13"
+    mdb.write(table, pd.DataFrame({"k": [3], "v": [9], "s": ["a"]}))
+    mdb.write(table, pd.DataFrame({"k": [], "v": [], "s": []}))
+    mdb.delete_where_equal(table, pd.DataFrame({"s": ["c"]}))
+    t = mdb.read(table)
+    assert len(t[t["v"].isin([1, 2, 3])].to_pd()) == 0